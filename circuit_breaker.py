@@ -0,0 +1,211 @@
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# --- СОСТОЯНИЯ ПРЕДОХРАНИТЕЛЯ ---
+
+CLOSED = "closed"        # Всё работает, запросы идут как обычно
+OPEN = "open"            # Сервис считается недоступным, запросы отклоняются сразу
+HALF_OPEN = "half_open"  # Пробуем пропустить один запрос, чтобы проверить, ожил ли сервис
+
+
+class CircuitOpenError(Exception):
+    """Выбрасывается, когда предохранитель разомкнут и запрос не выполняется."""
+
+    def __init__(self, breaker: "CircuitBreaker"):
+        self.name = breaker.name
+        self.retry_after = breaker.retry_after()
+        super().__init__(f"Сервис '{self.name}' временно недоступен, повтор {format_retry_after(self.retry_after)}.")
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для одной внешней зависимости.
+    Считает долю ошибок среди последних вызовов и, если она превышает порог,
+    размыкается на recovery_timeout секунд. Затем пропускает пробные запросы (half-open):
+    успех замыкает цепь, ошибка снова размыкает её.
+    """
+
+    def __init__(self, name: str, failure_rate_threshold: float = 0.5, window_size: int = 10,
+                 min_calls: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_calls = min_calls
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = CLOSED
+        self._results = deque(maxlen=window_size)  # True — успех, False — ошибка
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._probe_started_at = 0.0
+        # Номер «поколения» состояния: растёт при каждом переходе и при списании зависших проб.
+        # Результаты вызовов, начатых в прошлом поколении, больше не влияют на предохранитель.
+        self._generation = 0
+
+    def retry_after(self) -> float:
+        """
+        Сколько секунд осталось до следующей пробы.
+        В half-open с занятыми слотами — сколько ещё ждать, пока текущая проба не будет признана зависшей.
+        """
+        now = time.monotonic()
+        if self.state == OPEN:
+            return max(0.0, self._opened_at + self.recovery_timeout - now)
+        if self.state == HALF_OPEN and self._half_open_calls >= self.half_open_max_calls:
+            return max(0.0, self._probe_started_at + self.recovery_timeout - now)
+        return 0.0
+
+    def _release_stale_probes(self) -> None:
+        """Если проба так и не сообщила результат за recovery_timeout, освобождаем слоты под новую."""
+        if self.state == HALF_OPEN and self._half_open_calls and self.retry_after() == 0:
+            print(f"🟡 Предохранитель '{self.name}': проба зависла, разрешаю новую.")
+            self._half_open_calls = 0
+            self._generation += 1
+
+    def is_open(self) -> bool:
+        """Проверяет состояние без резервирования пробного запроса — для быстрой проверки в обработчиках."""
+        self._release_stale_probes()
+        if self.state == OPEN:
+            return self.retry_after() > 0
+        if self.state == HALF_OPEN:
+            return self._half_open_calls >= self.half_open_max_calls
+        return False
+
+    def probe_due(self) -> bool:
+        """Будет ли следующий разрешённый запрос пробным — такой запрос стоит выполнить отдельно от пачки."""
+        self._release_stale_probes()
+        if self.state == OPEN:
+            return self.retry_after() == 0
+        if self.state == HALF_OPEN:
+            return self._half_open_calls < self.half_open_max_calls
+        return False
+
+    def allow_request(self) -> bool:
+        """Решает, можно ли выполнить запрос сейчас. В half-open резервирует слот под пробу."""
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                return False
+            print(f"🟡 Предохранитель '{self.name}': пробный запрос (half-open).")
+            self.state = HALF_OPEN
+            self._half_open_calls = 0
+            self._generation += 1
+
+        if self.state == HALF_OPEN:
+            self._release_stale_probes()
+            if self._half_open_calls >= self.half_open_max_calls:
+                return False
+            self._half_open_calls += 1
+            self._probe_started_at = time.monotonic()
+        return True
+
+    def check(self) -> None:
+        """Как allow_request, но выбрасывает CircuitOpenError вместо возврата False."""
+        if not self.allow_request():
+            raise CircuitOpenError(self)
+
+    @contextmanager
+    def call(self):
+        """
+        Оборачивает один запрос к зависимости: выбрасывает CircuitOpenError, если запрос не разрешён,
+        и гарантирует, что слот пробы освободится, даже если результат так и не был записан
+        (отмена задачи, неожиданное исключение).
+        """
+        self.check()
+        outcome = _CallOutcome(self, self._generation)
+        try:
+            yield outcome
+        finally:
+            if not outcome.reported:
+                self.release(outcome.generation)
+
+    def _is_stale(self, generation) -> bool:
+        return generation is not None and generation != self._generation
+
+    def release(self, generation: int | None = None) -> None:
+        """Освобождает слот пробы без учёта результата. Слоты списанных проб уже освобождены."""
+        if self._is_stale(generation):
+            return
+        if self.state == HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record_success(self, generation: int | None = None) -> None:
+        if self._is_stale(generation):
+            return
+        if self.state == HALF_OPEN:
+            print(f"🟢 Предохранитель '{self.name}': сервис снова доступен.")
+            self.state = CLOSED
+            self._half_open_calls = 0
+            self._generation += 1
+            self._results.clear()
+        self._results.append(True)
+
+    def record_failure(self, generation: int | None = None) -> None:
+        if self._is_stale(generation):
+            return
+        if self.state == HALF_OPEN:
+            self._trip()
+            return
+        if self.state == OPEN:
+            # Запросы, начатые до размыкания, не продлевают таймаут
+            return
+        self._results.append(False)
+        failures = self._results.count(False)
+        if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_rate_threshold:
+            self._trip()
+
+    def _trip(self) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._half_open_calls = 0
+        self._generation += 1
+        self._results.clear()
+        print(f"🔴 Предохранитель '{self.name}' разомкнут на {self.recovery_timeout:.0f} с.")
+
+
+class _CallOutcome:
+    """Результат одного вызова внутри CircuitBreaker.call(); учитывается не больше одного раза."""
+
+    def __init__(self, breaker: CircuitBreaker, generation: int):
+        self._breaker = breaker
+        self.generation = generation
+        self.reported = False
+
+    def success(self) -> None:
+        if not self.reported:
+            self.reported = True
+            self._breaker.record_success(self.generation)
+
+    def failure(self) -> None:
+        if not self.reported:
+            self.reported = True
+            self._breaker.record_failure(self.generation)
+
+
+def format_retry_after(seconds: float) -> str:
+    """Текст для пользователя: округляем вверх, чтобы не показывать «через 0 с»."""
+    return f"через {max(1, math.ceil(seconds))} с"
+
+
+# --- ОБЩЕЕ СОСТОЯНИЕ ДЛЯ ВСЕХ МОДУЛЕЙ ---
+
+# min_calls не даёт одной случайной ошибке сразу после запуска или восстановления
+# превратиться в «50% отказов» и разомкнуть цепь
+BREAKERS = {
+    "gemini_generate": CircuitBreaker("gemini_generate", recovery_timeout=60.0),
+    "spotify_token": CircuitBreaker("spotify_token", recovery_timeout=30.0),
+    # Поиск делает до 50 параллельных запросов, поэтому окно шире
+    "spotify_search": CircuitBreaker("spotify_search", window_size=20, min_calls=10, recovery_timeout=30.0),
+    "spotify_playlist": CircuitBreaker("spotify_playlist", recovery_timeout=30.0),
+}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Возвращает общий предохранитель по имени зависимости."""
+    return BREAKERS[name]
+
+
+def open_breakers(*names: str) -> list[CircuitBreaker]:
+    """Возвращает разомкнутые предохранители из перечисленных — обработчики проверяют их перед работой."""
+    return [BREAKERS[name] for name in names if BREAKERS[name].is_open()]
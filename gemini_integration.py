@@ -2,8 +2,11 @@ import os
 import json
 from dotenv import load_dotenv
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import asyncio
 
+import circuit_breaker
+
 # Загружаем ключи из .env
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -15,48 +18,106 @@ if not GEMINI_API_KEY:
 genai.configure(api_key=GEMINI_API_KEY)
 
 
-# --- ОСНОВНАЯ ФУНКЦИЯ ---
+# Общий предохранитель для вызовов генерации
+_breaker = circuit_breaker.get_breaker("gemini_generate")
 
-async def get_gemini_response(user_prompt: str) -> str:
+# Таймаут запроса по умолчанию, если в prompt_config.json не задан request_timeout
+DEFAULT_REQUEST_TIMEOUT = 60
+
+# Ошибки, которые говорят о сбое на стороне Gemini, а не о нашем запросе или ключе
+OUTAGE_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.RetryError,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+# Ошибки чтения prompt_config.json — это не сбой Gemini, о них нужно сообщать как есть
+CONFIG_ERRORS = (FileNotFoundError, json.JSONDecodeError, KeyError)
+
+TIMEOUT_MESSAGE = "⏳ Gemini не ответил вовремя. Попробуй ещё раз чуть позже."
+
+
+def describe_config_error(error: Exception) -> str:
+    """Текст для пользователя об ошибке в prompt_config.json."""
+    if isinstance(error, FileNotFoundError):
+        return "Ошибка: Файл конфигурации prompt_config.json не найден."
+    if isinstance(error, json.JSONDecodeError):
+        return "Ошибка: Не удалось прочитать prompt_config.json. Проверьте синтаксис JSON."
+    return f"Ошибка: в файле prompt_config.json отсутствует обязательный ключ: {error}."
+
+
+# --- ОСНОВНЫЕ ФУНКЦИИ ---
+
+async def generate_gemini_text(user_prompt: str) -> str:
     """
     Отправляет запрос в API Gemini, используя конфигурацию из файла prompt_config.json.
+    В отличие от get_gemini_response, не превращает ошибки в текст, а выбрасывает их.
+    Если предохранитель разомкнут, сразу выбрасывает CircuitOpenError без обращения к API.
+    """
+    # Шаг 1: Читаем конфигурацию из файла
+    with open('prompt_config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    # Шаг 2: Инициализируем модель с параметрами из файла
+    model = genai.GenerativeModel(
+        model_name=config["model_name"],
+        generation_config=config["generation_config"],
+        safety_settings=config["safety_settings"]
+    )
+
+    # Шаг 3: Собираем полный промпт
+    full_prompt = f"{config['system_prompt']}\n\nЗАПРОС ПОЛЬЗОВАТЕЛЯ:\n{user_prompt}"
+
+    # Шаг 4: Отправляем запрос в API через предохранитель.
+    # Зависший запрос тоже считаем сбоем, иначе предохранитель никогда не сработает.
+    timeout = config.get("request_timeout", DEFAULT_REQUEST_TIMEOUT)
+    with _breaker.call() as call:
+        try:
+            response = await asyncio.wait_for(
+                asyncio.to_thread(
+                    model.generate_content,
+                    full_prompt,
+                    request_options={"timeout": timeout}
+                ),
+                timeout=timeout
+            )
+        except OUTAGE_ERRORS:
+            call.failure()
+            raise
+        except Exception:
+            # Неверный ключ, слишком большой запрос и т.п. — сервис жив, ошибка наша
+            call.success()
+            raise
+        call.success()
+
+    # Блокировка ответа фильтрами безопасности — не сбой сервиса, поэтому текст читаем уже после учёта
+    return response.text
+
+
+async def get_gemini_response(user_prompt: str) -> str:
+    """
+    Отправляет запрос в API Gemini и всегда возвращает строку для показа пользователю.
     Читает конфигурацию при каждом вызове.
     """
     try:
-        # Шаг 1: Читаем конфигурацию из файла
-        with open('prompt_config.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-
-        # Шаг 2: Инициализируем модель с параметрами из файла
-        model = genai.GenerativeModel(
-            # 👇 ВОТ ИЗМЕНЕНИЕ: читаем имя модели из конфига
-            model_name=config["model_name"], 
-            generation_config=config["generation_config"],
-            safety_settings=config["safety_settings"]
-        )
-
-        # Шаг 3: Собираем полный промпт
-        full_prompt = f"{config['system_prompt']}\n\nЗАПРОС ПОЛЬЗОВАТЕЛЯ:\n{user_prompt}"
-
-        # Шаг 4: Отправляем запрос в API
-        response = await asyncio.to_thread(
-            model.generate_content,
-            full_prompt
-        )
-        return response.text
-
-    except FileNotFoundError:
-        error_message = "Ошибка: Файл конфигурации prompt_config.json не найден."
-        print(error_message)
-        return error_message
-    except json.JSONDecodeError:
-        error_message = "Ошибка: Не удалось прочитать prompt_config.json. Проверьте синтаксис JSON."
-        print(error_message)
-        return error_message
-    except KeyError as e:
-        error_message = f"Ошибка: в файле prompt_config.json отсутствует обязательный ключ: {e}."
+        return await generate_gemini_text(user_prompt)
+
+    except circuit_breaker.CircuitOpenError as e:
+        print(f"⏸ Запрос к Gemini пропущен: {e}")
+        return f"⏸ Gemini сейчас недоступен. Попробуй снова {circuit_breaker.format_retry_after(e.retry_after)}."
+    except CONFIG_ERRORS as e:
+        error_message = describe_config_error(e)
         print(error_message)
         return error_message
+    except asyncio.TimeoutError:
+        print(TIMEOUT_MESSAGE)
+        return TIMEOUT_MESSAGE
     except Exception as e:
         error_message = f"Произошла ошибка при запросе к Gemini API: {e}"
         print(error_message)
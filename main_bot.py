@@ -1,7 +1,9 @@
 import os
 import re
+import asyncio
 import random
 import json
+from cachetools import LRUCache
 from dotenv import load_dotenv
 from functools import wraps # Импортируем wraps для создания декоратора
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -18,6 +20,7 @@ from telegram.ext import (
 # Импортируем наши модули
 import gemini_integration
 import spotify_integration
+import circuit_breaker
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -47,6 +50,9 @@ def allowed_users_only(func):
         return await func(update, context, *args, **kwargs)
     return wrapped
 
+# Последние списки песен от Gemini по запросу — запасной вариант, пока Gemini недоступен
+CANDIDATE_CACHE = LRUCache(maxsize=200)
+
 # Состояния для диалогов
 (PROMPT_TEST_STATE, PLAYLIST_UPDATE_STATE) = range(2)
 
@@ -138,10 +144,49 @@ def parse_gemini_tracks(text: str) -> list[str]:
 async def handle_playlist_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Полный цикл обновления плейлиста с динамическим вероятностным фильтром."""
     user_message = update.message.text
+    cache_key = user_message.strip().lower()
+
+    # Без записи в плейлист сборка бессмысленна, поэтому сразу отказываем, если Spotify лежит.
+    # Сервис авторизации нужен, только если сохранённый токен уже истёк.
+    required_breakers = ["spotify_playlist"]
+    if not spotify_integration.has_valid_access_token():
+        required_breakers.append("spotify_token")
+    unavailable = circuit_breaker.open_breakers(*required_breakers)
+    if unavailable:
+        retry_after = max(breaker.retry_after() for breaker in unavailable)
+        await update.message.reply_text(f"⏸ Spotify сейчас недоступен. Попробуй снова {circuit_breaker.format_retry_after(retry_after)}.")
+        return await cancel(update, context)
+
     await update.message.reply_text("✨ Начинаю магию... Это может занять до минуты.\n\n1️⃣ / 5️⃣ Получаю плейлист от Gemini...")
     
-    gemini_response = await gemini_integration.get_gemini_response(user_message)
-    tracks = parse_gemini_tracks(gemini_response)
+    try:
+        gemini_response = await gemini_integration.generate_gemini_text(user_message)
+        tracks = parse_gemini_tracks(gemini_response)
+        if tracks:
+            CANDIDATE_CACHE[cache_key] = tracks
+    except gemini_integration.CONFIG_ERRORS as e:
+        error_message = gemini_integration.describe_config_error(e)
+        print(error_message)
+        await update.message.reply_text(error_message)
+        return await cancel(update, context)
+    except (circuit_breaker.CircuitOpenError, *gemini_integration.OUTAGE_ERRORS) as e:
+        # Сохранённый список подставляем только при сбое самого Gemini
+        print(f"🔥 Gemini недоступен: {e!r}")
+        tracks = CANDIDATE_CACHE.get(cache_key)
+        if not tracks:
+            if isinstance(e, circuit_breaker.CircuitOpenError):
+                await update.message.reply_text(f"⏸ Gemini сейчас недоступен. Попробуй снова {circuit_breaker.format_retry_after(e.retry_after)}.")
+            elif isinstance(e, asyncio.TimeoutError):
+                await update.message.reply_text(gemini_integration.TIMEOUT_MESSAGE)
+            else:
+                await update.message.reply_text(f"🔥 Gemini сейчас недоступен: {e or type(e).__name__}")
+            return await cancel(update, context)
+        await update.message.reply_text("⚠️ Gemini недоступен, использую сохранённый список по этому запросу.")
+    except Exception as e:
+        # Текст ошибки отправляем без Markdown: в нём могут быть символы разметки
+        print(f"🔥 Ошибка при запросе к Gemini: {e!r}")
+        await update.message.reply_text(f"🔥 Не удалось получить ответ от Gemini.\n\n{e or type(e).__name__}")
+        return await cancel(update, context)
     
     if not tracks:
         await update.message.reply_text("🤷‍♂️ Gemini не вернул список песен. Попробуй другой запрос.")
@@ -184,11 +229,13 @@ async def handle_playlist_update(update: Update, context: ContextTypes.DEFAULT_T
     
     # ... остальная часть функции без изменений ...
     await update.message.reply_text(f"2️⃣ / 5️⃣ Gemini предложил {len(tracks)} треков. После отбора осталось {len(filtered_tracks)}. Ищу их в Spotify...")
-    tracks_data = await spotify_integration.get_tracks_data_async(filtered_tracks)
+    tracks_data, from_cache = await spotify_integration.get_tracks_data_async(filtered_tracks)
     
     if not tracks_data:
         await update.message.reply_text("🤷‍♂️ Не удалось найти ни одного из отобранных треков в Spotify.")
         return await cancel(update, context)
+    if from_cache:
+        await update.message.reply_text(f"⚠️ Поиск Spotify недоступен, использую ранее найденные треки: {len(tracks_data)} из {len(filtered_tracks)}.")
     
     # tracks_data.reverse()
     
@@ -3,8 +3,12 @@ import base64
 import httpx
 import asyncio
 import json
+import time
+from cachetools import LRUCache
 from dotenv import load_dotenv
 
+import circuit_breaker
+
 load_dotenv()
 
 CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
@@ -12,83 +16,206 @@ CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 REFRESH_TOKEN = os.getenv("SPOTIFY_REFRESH_TOKEN")
 PLAYLIST_ID = os.getenv("SPOTIFY_PLAYLIST_ID")
 
+# --- ПРЕДОХРАНИТЕЛИ И КЭШИ ---
+
+_token_breaker = circuit_breaker.get_breaker("spotify_token")
+_search_breaker = circuit_breaker.get_breaker("spotify_search")
+_playlist_breaker = circuit_breaker.get_breaker("spotify_playlist")
+
+# Последний полученный токен: используется до истечения срока, в том числе пока сервис авторизации недоступен
+_cached_token = {"access_token": None, "expires_at": 0.0}
+
+# Уже найденные треки: запрос -> {название, исполнитель, uri}
+_resolved_tracks = LRUCache(maxsize=5000)
+
+
+def _is_outage_status(status_code: int) -> bool:
+    """Ответы, которые говорят о сбое на стороне Spotify, а не о нашей ошибке."""
+    return status_code >= 500 or status_code == 429
+
+
+def _track_cache_key(track_name: str) -> str:
+    return track_name.strip().lower()
+
 # --- УПРАВЛЕНИЕ ТОКЕНОМ ДОСТУПА ---
 
+def _get_cached_access_token():
+    """Возвращает сохранённый токен, если он ещё не истёк."""
+    if _cached_token["access_token"] and time.monotonic() < _cached_token["expires_at"]:
+        return _cached_token["access_token"]
+    return None
+
+def has_valid_access_token() -> bool:
+    """Есть ли действующий токен, с которым можно работать без обращения к сервису авторизации."""
+    return _get_cached_access_token() is not None
+
 def get_new_access_token():
-    """Синхронная функция для получения токена."""
-    # ... (код этой функции не меняется)
+    """Синхронная функция для получения токена. Пока сохранённый токен не истёк, возвращает его."""
+    cached_token = _get_cached_access_token()
+    if cached_token:
+        return cached_token
+
     auth_string = f"{CLIENT_ID}:{CLIENT_SECRET}"
     auth_base64 = str(base64.b64encode(auth_string.encode('utf-8')), 'utf-8')
     url = "https://accounts.spotify.com/api/token"
     headers = {"Authorization": f"Basic {auth_base64}", "Content-Type": "application/x-www-form-urlencoded"}
     data = {"grant_type": "refresh_token", "refresh_token": REFRESH_TOKEN}
     
-    response = httpx.post(url, headers=headers, data=data)
+    try:
+        with _token_breaker.call() as call:
+            try:
+                response = httpx.post(url, headers=headers, data=data)
+            except httpx.RequestError as e:
+                call.failure()
+                print(f"🔥 Ошибка сети при обновлении токена: {e}")
+                return None
+
+            if _is_outage_status(response.status_code):
+                call.failure()
+                print(f"🔥 Spotify не выдал токен (HTTP {response.status_code}).")
+                return None
+            call.success()
+    except circuit_breaker.CircuitOpenError as e:
+        print(f"⏸ Запрос токена Spotify пропущен: {e}")
+        return None
+
     if response.status_code != 200:
         print(f"🔥 Ошибка обновления токена: {response.json()}")
         return None
-    return response.json().get("access_token")
+    payload = response.json()
+    access_token = payload.get("access_token")
+    # Запас в минуту, чтобы не отдать токен, который истечёт прямо во время запроса
+    _cached_token["access_token"] = access_token
+    _cached_token["expires_at"] = time.monotonic() + payload.get("expires_in", 3600) - 60
+    return access_token
 
 # --- АСИНХРОННЫЕ ФУНКЦИИ ПОИСКА ---
 
 async def search_track_async(client: httpx.AsyncClient, track_name: str):
-    """Асинхронно ищет ОДИН трек и возвращает СЛОВАРЬ {название, исполнитель, uri}."""
+    """
+    Асинхронно ищет ОДИН трек и возвращает СЛОВАРЬ {название, исполнитель, uri}.
+    Если предохранитель поиска не пропускает запрос, выбрасывает CircuitOpenError.
+    """
+    cache_key = _track_cache_key(track_name)
     url = "https://api.spotify.com/v1/search"
     params = {"q": track_name, "type": "track", "limit": 1}
     
-    try:
-        response = await client.get(url, params=params)
-        response.raise_for_status()
-        items = response.json().get("tracks", {}).get("items", [])
-        if items:
-            track_info = items[0]
-            # 👇 ИЗМЕНЕНИЕ: Возвращаем словарь вместо строки
-            return {
-                "name": track_info.get("name"),
-                "artist": track_info["artists"][0].get("name") if track_info.get("artists") else "Неизвестен",
-                "uri": track_info.get("uri")
-            }
-        else:
-            print(f"❌ Не найден: {track_name}")
-            return None
-    except httpx.RequestError as e:
-        print(f"🔥 Ошибка сети при поиске '{track_name}': {e}")
+    with _search_breaker.call() as call:
+        try:
+            response = await client.get(url, params=params)
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            if _is_outage_status(e.response.status_code):
+                call.failure()
+            else:
+                call.success()
+            if _search_breaker.state != circuit_breaker.OPEN:
+                print(f"🔥 Ошибка Spotify (HTTP {e.response.status_code}) при поиске '{track_name}'")
+            return _resolved_tracks.get(cache_key)
+        except httpx.RequestError as e:
+            call.failure()
+            # После размыкания предохранителя не засоряем лог одинаковыми ошибками
+            if _search_breaker.state != circuit_breaker.OPEN:
+                print(f"🔥 Ошибка сети при поиске '{track_name}': {e}")
+            return _resolved_tracks.get(cache_key)
+        call.success()
+
+    items = response.json().get("tracks", {}).get("items", [])
+    if items:
+        track_info = items[0]
+        track_data = {
+            "name": track_info.get("name"),
+            "artist": track_info["artists"][0].get("name") if track_info.get("artists") else "Неизвестен",
+            "uri": track_info.get("uri")
+        }
+        _resolved_tracks[cache_key] = track_data
+        return track_data
+    else:
+        print(f"❌ Не найден: {track_name}")
         return None
 
-async def get_tracks_data_async(track_list: list[str]) -> list[dict]:
-    """Асинхронно ищет ВСЕ треки и возвращает список словарей."""
+def _get_cached_tracks_data(track_list: list[str]) -> list[dict]:
+    """Собирает треки только из кэша, без обращения к Spotify."""
+    results = [_resolved_tracks.get(_track_cache_key(name)) for name in track_list]
+    return [track_data for track_data in results if track_data and track_data.get("uri")]
+
+async def _resolve_track_async(client: httpx.AsyncClient, track_name: str) -> tuple[dict | None, bool]:
+    """Ищет трек, а если предохранитель не пропустил запрос — берёт его из кэша. Второй элемент — взят ли из кэша."""
+    try:
+        return await search_track_async(client, track_name), False
+    except circuit_breaker.CircuitOpenError:
+        return _resolved_tracks.get(_track_cache_key(track_name)), True
+
+async def get_tracks_data_async(track_list: list[str]) -> tuple[list[dict], bool]:
+    """
+    Асинхронно ищет ВСЕ треки и возвращает (список словарей, взяты ли треки из кэша).
+    Если поиск Spotify недоступен, возвращает только треки, найденные ранее.
+    """
+    if _search_breaker.is_open():
+        print("⏸ Поиск Spotify недоступен, беру треки из кэша.")
+        return _get_cached_tracks_data(track_list), True
+
     access_token = get_new_access_token()
-    if not access_token: return []
+    if not access_token: return _get_cached_tracks_data(track_list), True
 
     headers = {"Authorization": f"Bearer {access_token}"}
+    results = []
+    pending = list(track_list)
     
     async with httpx.AsyncClient(headers=headers) as client:
-        tasks = [search_track_async(client, name) for name in track_list]
-        results = await asyncio.gather(*tasks)
+        # В half-open пропускается только один запрос: выполняем пробу отдельно,
+        # иначе остальные запросы пачки будут отклонены, хотя сервис уже мог ожить
+        if pending and _search_breaker.probe_due():
+            results.append(await _resolve_track_async(client, pending.pop(0)))
+        if _search_breaker.state == circuit_breaker.CLOSED:
+            tasks = [_resolve_track_async(client, name) for name in pending]
+            results += await asyncio.gather(*tasks)
+        else:
+            print("⏸ Пробный поиск Spotify не удался, беру остальные треки из кэша.")
+            results += [(_resolved_tracks.get(_track_cache_key(name)), True) for name in pending]
     
-    return [track_data for track_data in results if track_data and track_data.get("uri")]
+    from_cache = any(cached for _, cached in results)
+    tracks_data = [track_data for track_data, _ in results if track_data and track_data.get("uri")]
+    return tracks_data, from_cache
 
 # --- СИНХРОННЫЕ ФУНКЦИИ ДЛЯ РАБОТЫ С ПЛЕЙЛИСТОМ ---
 
+def _send_playlist_request(client: httpx.Client, method: str, url: str, **kwargs):
+    """Выполняет запрос к плейлисту через предохранитель. Возвращает ответ или None при сбое."""
+    try:
+        with _playlist_breaker.call() as call:
+            try:
+                response = client.request(method, url, **kwargs)
+            except httpx.RequestError as e:
+                call.failure()
+                print(f"🔥 Ошибка сети при работе с плейлистом: {e}")
+                return None
+            if _is_outage_status(response.status_code):
+                call.failure()
+            else:
+                call.success()
+            return response
+    except circuit_breaker.CircuitOpenError as e:
+        print(f"⏸ Запрос к плейлисту пропущен: {e}")
+        return None
+
 def clear_playlist(access_token):
     """Удаляет все треки из плейлиста."""
-    # ... (код этой функции не меняется)
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-    get_tracks_url = f"https://api.spotify.com/v1/playlists/{PLAYLIST_ID}/tracks"
-    response = httpx.get(get_tracks_url, headers=headers, params={"fields": "items(track(uri))"})
-    if response.status_code != 200: return False
-    tracks_to_delete = response.json().get("items", [])
-    if not tracks_to_delete: 
-        print("Плейлист уже пуст.")
-        return True
-    uris_to_delete = [{"uri": item["track"]["uri"]} for item in tracks_to_delete]
-    delete_url = f"https://api.spotify.com/v1/playlists/{PLAYLIST_ID}/tracks"
-    with httpx.Client() as client:
+    tracks_url = f"https://api.spotify.com/v1/playlists/{PLAYLIST_ID}/tracks"
+    with httpx.Client(headers=headers) as client:
+        response = _send_playlist_request(client, "GET", tracks_url, params={"fields": "items(track(uri))"})
+        if response is None or response.status_code != 200: return False
+        tracks_to_delete = response.json().get("items", [])
+        if not tracks_to_delete: 
+            print("Плейлист уже пуст.")
+            return True
+        uris_to_delete = [{"uri": item["track"]["uri"]} for item in tracks_to_delete]
         for i in range(0, len(uris_to_delete), 100):
             chunk = uris_to_delete[i:i + 100]
             request_body = json.dumps({"tracks": chunk})
-            request = httpx.Request("DELETE", delete_url, headers=headers, content=request_body)
-            delete_response = client.send(request)
+            delete_response = _send_playlist_request(client, "DELETE", tracks_url, content=request_body)
+            if delete_response is None: return False
             if delete_response.status_code not in [200, 201]: 
                 print(f"🔥 Ошибка при удалении треков: {delete_response.text}")
                 return False
@@ -111,10 +238,11 @@ def add_tracks_to_playlist(access_token, tracks_data: list[dict]):
     url = f"https://api.spotify.com/v1/playlists/{PLAYLIST_ID}/tracks"
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
 
-    for i in range(0, len(track_uris), 100):
-        chunk = track_uris[i:i + 100]
-        response = httpx.post(url, headers=headers, json={"uris": chunk})
-        if response.status_code not in [200, 201]: return False
+    with httpx.Client(headers=headers) as client:
+        for i in range(0, len(track_uris), 100):
+            chunk = track_uris[i:i + 100]
+            response = _send_playlist_request(client, "POST", url, json={"uris": chunk})
+            if response is None or response.status_code not in [200, 201]: return False
     
     print(f"В плейлист добавлено {len(track_uris)} новых треков.")
     return True
\ No newline at end of file